@@ -1,7 +1,7 @@
+import asyncio
 import os
 import re
-from typing import Optional, Tuple
-from urllib.parse import urlparse
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -15,18 +15,27 @@ from telegram.ext import (
 from loguru import logger
 from animachpostingbot.database.database import db_instance as db
 from animachpostingbot.config.config import TELEGRAM_CHANNEL_ID
+from animachpostingbot.utils.urls import parse_source_and_user
 
 # Get admin IDs from environment variable.
 # Example in .env: ADMIN_IDS=123456789,987654321
 raw_admins = os.getenv("ADMIN_IDS", "")
-ADMIN_IDS = [int(x.strip()) for x in raw_admins.split(",") if x.strip()]
+ADMIN_IDS: FrozenSet[int] = frozenset(int(x.strip()) for x in raw_admins.split(",") if x.strip())
+# Attached to every admin command handler, so PTB rejects non-admins before the handler runs.
+ADMIN_FILTER = filters.User(user_id=ADMIN_IDS)
 
 DEFAULT_SOURCE = "pixiv"  # Default source if not defined
 
+# Bot API limit on message IDs per deleteMessages call.
+DELETE_MESSAGES_BATCH_SIZE = 100
+# Upper bound on single-message deletes in flight when a batch call has to be split up.
+DELETE_MESSAGE_CONCURRENCY = 25
+
 
 def parse_user_from_url(url: str) -> Tuple[Optional[str], Optional[str]]:
     """
     Parses the given URL and returns a tuple (source, user_id).
+    The parsing itself is memoized by parse_source_and_user; the outcome is logged on every call.
 
     Examples:
       - https://www.pixiv.net/en/users/64792103  -> ("pixiv", "64792103")
@@ -35,36 +44,38 @@ def parse_user_from_url(url: str) -> Tuple[Optional[str], Optional[str]]:
 
     If the source or user_id cannot be determined, returns (None, None).
     """
-    parsed = urlparse(url)
-    domain = parsed.netloc.lower()
-
-    # For Pixiv: look for URLs like /users/<id> or /en/users/<id>
-    if "pixiv.net" in domain:
-        m = re.search(r"/(?:\w+/)?users/(\d+)", parsed.path)
-        if m:
-            logger.debug(f"URL parsed as Pixiv with user_id: {m.group(1)}")
-            return "pixiv", m.group(1)
+    source, user_id = parse_source_and_user(url)
+    if user_id is None:
+        logger.error(f"Could not parse source/user_id from URL: {url}")
+    else:
+        logger.debug("URL parsed as {} with user_id: {}", source.capitalize(), user_id)
+    return source, user_id
 
-    # For Twitter (or x.com)
-    if "twitter.com" in domain or "x.com" in domain:
-        # Assume the URL is of the form /<username>
-        path_parts = [part for part in parsed.path.split("/") if part]
-        if path_parts:
-            logger.debug(f"URL parsed as Twitter with user_id: {path_parts[0]}")
-            return "twitter", path_parts[0]
 
-    logger.error(f"Could not parse source/user_id from URL: {url}")
-    return None, None
+def unique_args(args: Optional[List[str]]) -> List[str]:
+    """Strips command arguments and drops empty and repeated ones, keeping their order."""
+    return list(filter(None, dict.fromkeys(map(str.strip, args or []))))
 
 
 async def get_all_users() -> list[str]:
     """Returns a combined list of all user IDs from the database (all sources)."""
-    pixiv_users = await db.list_users_by_source("pixiv")
-    twitter_users = await db.list_users_by_source("twitter")
-    logger.debug(f"Found {len(pixiv_users)} Pixiv users and {len(twitter_users)} Twitter users in DB.")
+    # Served from the database's users cache, so paging through /listusers doesn't
+    # re-read the users table.
+    users_by_source = await db.list_users_grouped_by_source()
+    pixiv_users = users_by_source.get("pixiv", [])
+    twitter_users = users_by_source.get("twitter", [])
+    logger.debug("Found {} Pixiv users and {} Twitter users in DB.", len(pixiv_users), len(twitter_users))
     return pixiv_users + twitter_users
 
 
+# Formats used by paginate_users for each listed user and for the page buttons.
+USER_LINE_FORMAT = "<code>{}</code>"
+PREV_PAGE_CALLBACK = "users_prev:{}"
+NEXT_PAGE_CALLBACK = "users_next:{}"
+# Matches the callback data above; PTB only dispatches matching queries and passes the match on.
+PAGE_CALLBACK_RE = re.compile(r"^users_(?:prev|next):(\d+)$")
+
+
 def paginate_users(user_ids: list[str], page: int = 0, per_page: int = 10) -> Tuple[str, InlineKeyboardMarkup]:
     """
     Splits the list of user IDs into pages and returns formatted text with an inline keyboard.
@@ -75,14 +86,14 @@ def paginate_users(user_ids: list[str], page: int = 0, per_page: int = 10) -> Tu
     end = start + per_page
     page_users = user_ids[start:end]
 
-    text = f"<b>Parsed Users (Page {page + 1}/{total_pages}) [Total: {total}]</b>\n"
-    text += "\n".join(f"<code>{uid}</code>" for uid in page_users)
+    header = f"<b>Parsed Users (Page {page + 1}/{total_pages}) [Total: {total}]</b>"
+    text = "\n".join([header, *map(USER_LINE_FORMAT.format, page_users)])
 
     buttons = []
     if page > 0:
-        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"users_prev:{page - 1}"))
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=PREV_PAGE_CALLBACK.format(page - 1)))
     if end < total:
-        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"users_next:{page + 1}"))
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=NEXT_PAGE_CALLBACK.format(page + 1)))
 
     reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
     return text, reply_markup
@@ -95,16 +106,10 @@ async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     only users from that source are shown; otherwise, a combined list is shown.
     """
     message = update.effective_message
-    admin_id = update.effective_user.id if update.effective_user else None
-
-    if admin_id not in ADMIN_IDS:
-        logger.warning(f"Unauthorized access attempt to /listusers by user {admin_id}.")
-        await message.reply_text("You are not authorized to use this command.")
-        return
 
     if context.args and context.args[0].lower() in ["pixiv", "twitter"]:
         source = context.args[0].lower()
-        user_ids = await db.list_users_by_source(source)
+        user_ids = (await db.list_users_grouped_by_source()).get(source, [])
         logger.info(f"Listing users from source '{source}': found {len(user_ids)} user(s).")
     else:
         user_ids = await get_all_users()
@@ -126,12 +131,7 @@ async def paginate_users_callback(update: Update, context: ContextTypes.DEFAULT_
     if not query:
         return
     await query.answer()
-    try:
-        action, page_str = query.data.split(":")
-        page = int(page_str)
-    except Exception as e:
-        logger.error(f"Error parsing callback data: {query.data} - {e}")
-        return
+    page = int(context.matches[0].group(1))
 
     user_ids = await get_all_users()
     text, reply_markup = paginate_users(user_ids, page=page, per_page=10)
@@ -146,12 +146,6 @@ async def find_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     If two arguments are provided, the first is treated as the source.
     """
     message = update.effective_message
-    admin_id = update.effective_user.id if update.effective_user else None
-
-    if admin_id not in ADMIN_IDS:
-        logger.warning(f"Unauthorized access attempt to /finduser by user {admin_id}.")
-        await message.reply_text("You are not authorized to use this command.")
-        return
 
     if not context.args:
         await message.reply_text("Usage: /finduser <url> OR /finduser <source> <user_id>")
@@ -172,7 +166,7 @@ async def find_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user_id = context.args[1].strip()
 
     logger.info(f"Finding user: {user_id} in source: {source}")
-    users_in_source = await db.list_users_by_source(source)
+    users_in_source = await db.get_user_id_set(source)
     if user_id in users_in_source:
         await message.reply_text(
             f"User <code>{user_id}</code> exists in the <b>{source}</b> database. (Total in source: {len(users_in_source)})",
@@ -196,12 +190,7 @@ async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
       /adduser https://twitter.com/asou_asabu https://www.pixiv.net/en/users/64792103
     """
     message = update.effective_message
-    admin_id = update.effective_user.id if update.effective_user else None
-
-    if admin_id not in ADMIN_IDS:
-        logger.warning(f"Unauthorized access attempt to /adduser by user {admin_id}.")
-        await message.reply_text("You are not authorized to use this command.")
-        return
+    admin_id = update.effective_user.id
 
     if not context.args:
         await message.reply_text("Usage: /adduser <url1> <url2> ...")
@@ -211,25 +200,39 @@ async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     duplicates = []
     errors = []
 
-    for url in context.args:
+    try:
+        # One lookup of all users for the duplicate check instead of a query per URL.
+        existing = {
+            source: set(ids) for source, ids in (await db.list_users_grouped_by_source()).items()
+        }
+    except Exception as e:
+        logger.error(f"Error loading users for /adduser: {e}")
+        await message.reply_text("Failed to read users from the database.")
+        return
+
+    new_users = []
+    for url in unique_args(context.args):
         source, user_id = parse_user_from_url(url)
         if not source or not user_id:
             errors.append(url)
             logger.error(f"Failed to parse URL: {url}")
             continue
 
+        if user_id in existing.setdefault(source, set()):
+            duplicates.append(f"{url} ({source}:{user_id})")
+            logger.info(f"User already exists: {user_id} with source: {source}")
+            continue
+        existing[source].add(user_id)
+        new_users.append((user_id, source, url))
+
+    if new_users:
         try:
-            exists = await db.user_exists(user_id, source)
-            if exists:
-                duplicates.append(f"{url} ({source}:{user_id})")
-                logger.info(f"User already exists: {user_id} with source: {source}")
-            else:
-                await db.add_user(user_id, source)
-                added.append(f"{url} ({source}:{user_id})")
-                logger.info(f"Added user: {user_id} with source: {source} to the database.")
+            await db.add_users([(user_id, source) for user_id, source, _ in new_users])
+            added = [f"{url} ({source}:{user_id})" for user_id, source, url in new_users]
+            logger.info("Added users to the database: {}", added)
         except Exception as e:
-            logger.error(f"Error adding user from URL {url}: {e}")
-            errors.append(url)
+            logger.error(f"Error adding users: {e}")
+            errors.extend(url for _, _, url in new_users)
 
     reply_parts = []
     if added:
@@ -241,7 +244,10 @@ async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     reply_text = "\n".join(reply_parts)
     await message.reply_text(reply_text, parse_mode="HTML")
-    logger.info(f"Admin {admin_id} adduser result - Added: {added}, Duplicates: {duplicates}, Errors: {errors}")
+    # Loguru formats the (possibly long) lists only if a sink accepts the record.
+    logger.info(
+        "Admin {} adduser result - Added: {}, Duplicates: {}, Errors: {}", admin_id, added, duplicates, errors
+    )
 
 
 async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -252,12 +258,7 @@ async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     and removes them from the database.
     """
     message = update.effective_message
-    admin_id = update.effective_user.id if update.effective_user else None
-
-    if admin_id not in ADMIN_IDS:
-        logger.warning(f"Unauthorized access attempt to /removeuser by user {admin_id}.")
-        await message.reply_text("You are not authorized to use this command.")
-        return
+    admin_id = update.effective_user.id
 
     if not context.args:
         await message.reply_text("Usage: /removeuser <url1> <url2> ...")
@@ -266,21 +267,24 @@ async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     errors = []
     removed = []
 
-    for url in context.args:
+    # Group the parsed URLs by source so each source needs a single DELETE ... IN (...).
+    urls_by_source: Dict[str, Dict[str, str]] = {}
+    for url in unique_args(context.args):
         source, user_id = parse_user_from_url(url)
         if not source or not user_id:
             errors.append(url)
             logger.error(f"Failed to parse URL: {url}")
             continue
+        urls_by_source.setdefault(source, {})[user_id] = url
 
+    for source, urls_by_user in urls_by_source.items():
         try:
-            # Assumes that the remove_user method in the database accepts a list of user_ids and a source
-            await db.remove_user([user_id], source)
-            removed.append(f"{url} ({source}:{user_id})")
-            logger.info(f"Removed user: {user_id} with source: {source} from the database.")
+            await db.remove_user(list(urls_by_user), source)
+            removed.extend(f"{url} ({source}:{user_id})" for user_id, url in urls_by_user.items())
+            logger.info("Removed users: {} with source: {} from the database.", list(urls_by_user), source)
         except Exception as e:
-            logger.error(f"Error removing user from URL {url}: {e}")
-            errors.append(url)
+            logger.error(f"Error removing users from source {source}: {e}")
+            errors.extend(urls_by_user.values())
 
     reply_parts = []
     if removed:
@@ -290,7 +294,7 @@ async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
     reply_text = "\n".join(reply_parts)
     await message.reply_text(reply_text, parse_mode="HTML")
-    logger.info(f"Admin {admin_id} removeuser result - Removed: {removed}, Errors: {errors}")
+    logger.info("Admin {} removeuser result - Removed: {}, Errors: {}", admin_id, removed, errors)
 
 
 async def delete_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -299,12 +303,6 @@ async def delete_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     Deletes the specified messages from the Telegram channel.
     """
     message = update.effective_message
-    admin_id = update.effective_user.id if update.effective_user else None
-
-    if admin_id not in ADMIN_IDS:
-        logger.warning(f"Unauthorized access attempt to /deletepost by user {admin_id}.")
-        await message.reply_text("You are not authorized to use this command.")
-        return
 
     if not context.args:
         await message.reply_text("Usage: /deletepost <message_id1> [message_id2 ...]")
@@ -312,9 +310,9 @@ async def delete_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
     channel_id = TELEGRAM_CHANNEL_ID
     message_ids = []
-    for arg in context.args:
+    for arg in unique_args(context.args):
         try:
-            message_ids.append(int(arg.strip()))
+            message_ids.append(int(arg))
         except Exception as e:
             logger.error(f"Invalid message ID '{arg}': {e}")
 
@@ -322,17 +320,41 @@ async def delete_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await message.reply_text("No valid message IDs provided.")
         return
 
+    # deleteMessages skips IDs it cannot delete without saying which, so IDs sent in a
+    # successful batch call are only reported as requested; per-message results are exact.
+    requested = []
     successes = []
     failures = []
-    for msg_id in message_ids:
+    for start in range(0, len(message_ids), DELETE_MESSAGES_BATCH_SIZE):
+        chunk = message_ids[start:start + DELETE_MESSAGES_BATCH_SIZE]
         try:
-            await context.bot.delete_message(chat_id=channel_id, message_id=msg_id)
-            successes.append(str(msg_id))
+            # One deleteMessages call per chunk instead of one request per message.
+            await context.bot.delete_messages(chat_id=channel_id, message_ids=chunk)
+            requested.extend(str(msg_id) for msg_id in chunk)
+            continue
         except Exception as e:
-            logger.error(f"Failed to delete message {msg_id}: {e}")
-            failures.append(str(msg_id))
+            logger.warning(f"Batch delete of {len(chunk)} messages failed ({e}); deleting them one by one.")
+        # Fall back to per-message deletes, run concurrently, so each ID gets its own result.
+        semaphore = asyncio.Semaphore(DELETE_MESSAGE_CONCURRENCY)
+
+        async def delete_one(msg_id: int) -> None:
+            async with semaphore:
+                await context.bot.delete_message(chat_id=channel_id, message_id=msg_id)
+
+        results = await asyncio.gather(*(delete_one(msg_id) for msg_id in chunk), return_exceptions=True)
+        for msg_id, result in zip(chunk, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to delete message {msg_id}: {result}")
+                failures.append(str(msg_id))
+            else:
+                successes.append(str(msg_id))
 
     response_parts = []
+    if requested:
+        response_parts.append(
+            f"Requested deletion of messages: {', '.join(requested)} "
+            f"(Telegram skips messages that no longer exist or cannot be deleted)"
+        )
     if successes:
         response_parts.append(f"Deleted messages: {', '.join(successes)}")
     if failures:
@@ -340,39 +362,37 @@ async def delete_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     await message.reply_text("\n".join(response_parts))
 
 
+# Static /help reply, built once at import.
+HELP_TEXT = (
+    "Available commands:\n\n"
+    "<b>/listusers [source]</b> - List all parsed users. Optionally filter by source (pixiv or twitter).\n\n"
+    "<b>/finduser &lt;url&gt; OR /finduser &lt;source&gt; &lt;user_id&gt;</b> - Check if a user exists in the database.\n\n"
+    "<b>/adduser &lt;url1&gt; [url2 ...]</b> - Add one or more users by URL. Example:\n"
+    "<code>/adduser https://twitter.com/asou_asabu https://www.pixiv.net/en/users/64792103</code>\n\n"
+    "<b>/removeuser &lt;url1&gt; [url2 ...]</b> - Remove one or more users by URL.\n\n"
+    "<b>/deletepost &lt;message_id1&gt; [message_id2 ...]</b> - Delete posts from the Telegram channel.\n\n"
+    "<b>/help</b> - Show this help text.\n\n"
+    "Note: URL parsing is used to automatically determine the source and user ID."
+)
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Sends help text with available commands.
-    If the user is not authorized, shows an unauthorized message instead.
     """
-    message = update.effective_message
-    admin_id = update.effective_user.id if update.effective_user else None
-    if admin_id not in ADMIN_IDS:
-        await message.reply_text("You are not authorized to use this command.")
-        return
-
-    text = (
-        "Available commands:\n\n"
-        "<b>/listusers [source]</b> - List all parsed users. Optionally filter by source (pixiv or twitter).\n\n"
-        "<b>/finduser &lt;url&gt; OR /finduser &lt;source&gt; &lt;user_id&gt;</b> - Check if a user exists in the database.\n\n"
-        "<b>/adduser &lt;url1&gt; [url2 ...]</b> - Add one or more users by URL. Example:\n"
-        "<code>/adduser https://twitter.com/asou_asabu https://www.pixiv.net/en/users/64792103</code>\n\n"
-        "<b>/removeuser &lt;url1&gt; [url2 ...]</b> - Remove one or more users by URL.\n\n"
-        "<b>/deletepost &lt;message_id1&gt; [message_id2 ...]</b> - Delete posts from the Telegram channel.\n\n"
-        "<b>/help</b> - Show this help text.\n\n"
-        "Note: URL parsing is used to automatically determine the source and user ID."
-    )
-    await message.reply_text(text, parse_mode="HTML")
+    await update.effective_message.reply_text(HELP_TEXT, parse_mode="HTML")
 
 
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handles unknown commands by showing a message.
-    If the user is not authorized, shows an unauthorized message.
+    Commands from non-admins never reach the admin handlers (see ADMIN_FILTER)
+    and end up here, so they get the unauthorized message instead.
     """
     message = update.effective_message
     admin_id = update.effective_user.id if update.effective_user else None
     if admin_id not in ADMIN_IDS:
+        logger.warning(f"Unauthorized access attempt to {message.text} by user {admin_id}.")
         await message.reply_text("You are not authorized to use this command.")
     else:
         await message.reply_text("Unknown command. Use /help to see available commands.")
@@ -382,12 +402,12 @@ def register_admin_handlers(app: Application) -> None:
     """
     Registers admin command handlers.
     """
-    app.add_handler(CommandHandler("start", help_command))
-    app.add_handler(CommandHandler("listusers", list_users))
-    app.add_handler(CommandHandler("finduser", find_user))
-    app.add_handler(CommandHandler("adduser", add_user))
-    app.add_handler(CommandHandler("removeuser", remove_user))
-    app.add_handler(CommandHandler("deletepost", delete_post))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CallbackQueryHandler(paginate_users_callback, pattern=r'^users_'))
+    app.add_handler(CommandHandler("start", help_command, filters=ADMIN_FILTER))
+    app.add_handler(CommandHandler("listusers", list_users, filters=ADMIN_FILTER))
+    app.add_handler(CommandHandler("finduser", find_user, filters=ADMIN_FILTER))
+    app.add_handler(CommandHandler("adduser", add_user, filters=ADMIN_FILTER))
+    app.add_handler(CommandHandler("removeuser", remove_user, filters=ADMIN_FILTER))
+    app.add_handler(CommandHandler("deletepost", delete_post, filters=ADMIN_FILTER))
+    app.add_handler(CommandHandler("help", help_command, filters=ADMIN_FILTER))
+    app.add_handler(CallbackQueryHandler(paginate_users_callback, pattern=PAGE_CALLBACK_RE))
     app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
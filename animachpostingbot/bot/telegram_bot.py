@@ -1,54 +1,113 @@
 from io import BytesIO
 import asyncio
-import re
-from typing import Optional, Any, Tuple
-from urllib.parse import urlparse
+import random
+from collections import OrderedDict
+from typing import Optional, Any
 
 from telegram import InputMediaPhoto
 from telegram.error import RetryAfter, TimedOut
 from loguru import logger
 from animachpostingbot.image.image_resizer import validate_and_resize_image
-from animachpostingbot.config.config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID
+from animachpostingbot.utils.urls import parse_source_and_user
+from animachpostingbot.config.config import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHANNEL_ID,
+    TELEGRAM_MAX_CONCURRENT_SENDS,
+    TELEGRAM_SEND_INTERVAL_SECONDS,
+)
 
 # Build the Telegram application instance once.
 from telegram.ext import ApplicationBuilder
 application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
 
+# Workers prepare images concurrently; only this many of them upload at a time.
+send_semaphore = asyncio.Semaphore(TELEGRAM_MAX_CONCURRENT_SENDS)
+
+# Paces uploads across all workers instead of every worker idling after its own send.
+send_pacing_lock = asyncio.Lock()
+next_send_at = 0.0
+
+
+async def wait_for_send_slot() -> None:
+    """
+    Waits until at least TELEGRAM_SEND_INTERVAL_SECONDS have passed since the previous
+    upload started, then reserves the next slot.
+    The slot is checked again after every sleep, since defer_sends may have pushed it
+    further out in the meantime.
+    """
+    global next_send_at
+    async with send_pacing_lock:
+        loop = asyncio.get_running_loop()
+        while (wait := next_send_at - loop.time()) > 0:
+            await asyncio.sleep(wait)
+        next_send_at = loop.time() + TELEGRAM_SEND_INTERVAL_SECONDS
+
+
+def defer_sends(seconds: float) -> None:
+    """
+    Pushes the next send slot of every worker at least `seconds` into the future, so that
+    after a 429 the other workers don't keep hitting the limit while this one waits.
+    """
+    global next_send_at
+    next_send_at = max(next_send_at, asyncio.get_running_loop().time() + seconds)
+
+
+# Telegram file_ids of photos already uploaded, keyed by source image URL. Resending a
+# file_id makes Telegram reuse the stored photo, so the image is neither downloaded,
+# re-encoded nor uploaded again. Workers never resend a GUID, so this only helps when the
+# same image URL comes back under another GUID (e.g. a followed Twitter account
+# retweeting media of another followed account).
+PHOTO_FILE_ID_CACHE_SIZE = 2048
+photo_file_ids: "OrderedDict[str, str]" = OrderedDict()
+
+
+async def get_photo_media(image_url: str) -> BytesIO | str | None:
+    """
+    Returns the cached Telegram file_id for the image, or else the downloaded and resized image.
+    """
+    file_id = photo_file_ids.get(image_url)
+    if file_id is not None:
+        photo_file_ids.move_to_end(image_url)
+        logger.debug(f"Reusing Telegram file_id for image {image_url}")
+        return file_id
+    return await validate_and_resize_image(image_url)
+
+
+def remember_photo_file_ids(image_urls: list, messages) -> None:
+    """
+    Stores the file_ids of the sent album's photos; messages are in the same order as image_urls.
+    """
+    for image_url, message in zip(image_urls, messages):
+        if not message.photo:
+            continue
+        # The last PhotoSize is the largest one, i.e. the full uploaded image.
+        photo_file_ids[image_url] = message.photo[-1].file_id
+        photo_file_ids.move_to_end(image_url)
+        if len(photo_file_ids) > PHOTO_FILE_ID_CACHE_SIZE:
+            photo_file_ids.popitem(last=False)
+
 
 def parse_user_from_url(url: str) -> str | None | Any:
     """
-    Parses the given URL and returns a tuple (source, user_id).
+    Parses the given URL and returns the user's hashtag name (Pixiv IDs get an "I" prefix).
 
     Examples:
-      - https://www.pixiv.net/en/users/64792103  -> ("pixiv", "64792103")
-      - https://twitter.com/asou_asabu            -> ("twitter", "asou_asabu")
-      - https://x.com/asou_asabu/                 -> ("twitter", "asou_asabu")
+      - https://www.pixiv.net/en/users/64792103  -> "I64792103"
+      - https://twitter.com/asou_asabu            -> "asou_asabu"
+      - https://x.com/asou_asabu/                 -> "asou_asabu"
 
     If the source or user_id cannot be determined, returns None
+    The parsing itself is memoized by parse_source_and_user; the outcome is logged on every call.
     """
-    parsed = urlparse(url)
-    domain = parsed.netloc.lower()
-
-    # For Pixiv: look for URLs like /users/<id> or /en/users/<id>
-    if "pixiv.net" in domain:
-        m = re.search(r"/(?:\w+/)?users/(\d+)", parsed.path)
-        if m:
-            user_id = m.group(1)
-            logger.debug(f"URL parsed as Pixiv with user_id: {user_id}")
-            if user_id.isdigit():
-                return f"I{user_id}"
-            return user_id
-
-    # For Twitter (or x.com)
-    if "twitter.com" in domain or "x.com" in domain:
-        # Assume the URL is of the form /<username>
-        path_parts = [part for part in parsed.path.split("/") if part]
-        if path_parts:
-            logger.debug(f"URL parsed as Twitter with user_id: {path_parts[0]}")
-            return path_parts[0]
-
-    logger.error(f"Could not parse source/user_id from URL: {url}")
-    return None
+    source, user_id = parse_source_and_user(url)
+    if user_id is None:
+        logger.error(f"Could not parse source/user_id from URL: {url}")
+        return None
+
+    logger.debug(f"URL parsed as {source.capitalize()} with user_id: {user_id}")
+    if source == "pixiv" and user_id.isdigit():
+        return f"I{user_id}"
+    return user_id
 
 
 async def send_media_group_with_retries(chat_id: int | str, media_group: list, guid: str) -> Optional[Any]:
@@ -58,12 +117,15 @@ async def send_media_group_with_retries(chat_id: int | str, media_group: list, g
     and does not retry (to avoid duplicates).
     """
     max_retries = 5
+    max_delay = 60  # cap for our own exponential backoff, in seconds
     retries = 0
     delay = 1  # initial delay in seconds
 
     while retries < max_retries:
         try:
-            messages = await application.bot.send_media_group(chat_id=chat_id, media=media_group)
+            async with send_semaphore:
+                await wait_for_send_slot()
+                messages = await application.bot.send_media_group(chat_id=chat_id, media=media_group)
             logger.debug(
                 f"[send_media_group_with_retries] Message for GUID '{guid}' sent successfully on attempt {retries + 1}: {messages}"
             )
@@ -71,12 +133,16 @@ async def send_media_group_with_retries(chat_id: int | str, media_group: list, g
         except RetryAfter as e:
             retries += 1
             recommended_delay = getattr(e, 'retry_after', delay)
-            delay = max(delay, recommended_delay)
+            # Telegram's retry_after is always honored, even above max_delay.
+            delay = max(min(delay, max_delay), recommended_delay)
+            defer_sends(delay)
+            # Jitter keeps workers that were throttled together from retrying in lockstep.
+            delay_with_jitter = delay + random.uniform(0, 0.5)
             logger.warning(
-                f"[send_media_group_with_retries] Attempt {retries}/{max_retries} for GUID '{guid}' failed with error {e}. Retrying in {delay} seconds."
+                f"[send_media_group_with_retries] Attempt {retries}/{max_retries} for GUID '{guid}' failed with error {e}. Retrying in {delay_with_jitter:.1f} seconds."
             )
-            await asyncio.sleep(delay)
-            delay *= 2
+            await asyncio.sleep(delay_with_jitter)
+            delay = min(delay * 2, max_delay)
         except TimedOut as e:
             logger.warning(
                 f"[send_media_group_with_retries] TimedOut for GUID '{guid}': {e}. Assuming message delivered and not retrying."
@@ -97,42 +163,41 @@ async def send_images_to_telegram(images: list, user_link: str, guid: str) -> tu
     Returns a tuple: (True, messages) if successful, or (False, error_detail) on failure.
     """
     media_group = []
-    caption_added = False
+    # Source URLs of the images in media_group, in the same order.
+    sent_urls = []
 
     # Parse user info from the URL1
     user_id = parse_user_from_url(user_link)
     # Form the hashtag with username if available, else leave it empty.
     hashtag = f"#{user_id}" if user_id else ""
+    # Form the caption once: first line - hashtag (if available), second line - link to the post (guid)
+    album_info = f"{hashtag}\n<a href='{guid}'>{guid}</a>"
 
-    for image_url in images:
-        try:
-            image_data = await validate_and_resize_image(image_url)
-            if image_data is None:
-                logger.warning(f"Image data is None for URL: {image_url}. This image will be skipped.")
-                continue
-
-            if not caption_added:
-                # Form the caption: first line - hashtag (if available), second line - link to the post (guid)
-                album_info = f"{hashtag}\n<a href='{guid}'>{guid}</a>"
-                media_group.append(InputMediaPhoto(media=image_data, caption=album_info, parse_mode="HTML"))
-                caption_added = True
-            else:
-                media_group.append(InputMediaPhoto(media=image_data))
-        except Exception as e:
-            logger.error(f"Error processing image {image_url}: {e}")
+    # Download and resize all images of the album concurrently; gather keeps their order.
+    results = await asyncio.gather(
+        *(get_photo_media(image_url) for image_url in images), return_exceptions=True
+    )
+
+    for image_url, image_data in zip(images, results):
+        if isinstance(image_data, Exception):
+            logger.error(f"Error processing image {image_url}: {image_data}")
             continue
+        if image_data is None:
+            logger.warning(f"Image data is None for URL: {image_url}. This image will be skipped.")
+            continue
+
+        if media_group:
+            media_group.append(InputMediaPhoto(media=image_data))
+        else:
+            # The first image that made it through carries the album caption.
+            media_group.append(InputMediaPhoto(media=image_data, caption=album_info, parse_mode="HTML"))
+        sent_urls.append(image_url)
 
     if not media_group:
         err_msg = "No images to send"
         logger.error(err_msg)
         return False, err_msg
 
-    # If no image got a caption, assign a caption to the first image as a fallback.
-    if not caption_added and media_group:
-        album_info = f"<b>{hashtag}</b>\n<a href='{guid}'>{guid}</a>"
-        first_media = media_group[0]
-        first_media.caption = album_info
-
     # Send the media group using the GUID for logging
     messages = await send_media_group_with_retries(TELEGRAM_CHANNEL_ID, media_group, guid)
     if messages is None:
@@ -140,5 +205,5 @@ async def send_images_to_telegram(images: list, user_link: str, guid: str) -> tu
         logger.error(err_msg)
         return False, err_msg
 
-    await asyncio.sleep(1)
+    remember_photo_file_ids(sent_urls, messages)
     return True, messages
@@ -18,6 +18,15 @@ LOG_FILE: str = os.getenv("LOG_FILE", "../logs/bot.log")
 CHECK_INTERVAL_IN_SECONDS: int = int(os.getenv("CHECK_INTERVAL_IN_SECONDS", 3600)) # Default: 1 hour
 DB_FILE: str = os.getenv("DB_FILE", "../../data/database.db")
 RSSHUB_URL: str = os.getenv("RSSHUB_URL", "http://localhost:1200/")
+NUM_WORKERS: int = int(os.getenv("NUM_WORKERS", 4))
+# Capacity of the work queue, in image batches; feed processing waits while it is full.
+QUEUE_MAXSIZE: int = int(os.getenv("QUEUE_MAXSIZE", NUM_WORKERS * 4))
+# Upper bound on RSS feeds downloaded at the same time.
+FEED_FETCH_CONCURRENCY: int = int(os.getenv("FEED_FETCH_CONCURRENCY", 4))
+# Upper bound on send_media_group calls in flight at once, shared by all workers.
+TELEGRAM_MAX_CONCURRENT_SENDS: int = int(os.getenv("TELEGRAM_MAX_CONCURRENT_SENDS", 2))
+# Minimum spacing between the starts of two send_media_group calls, shared by all workers.
+TELEGRAM_SEND_INTERVAL_SECONDS: float = float(os.getenv("TELEGRAM_SEND_INTERVAL_SECONDS", 1))
 
 # Retrieve ADMIN_IDS from the environment; expected as a comma-separated list, e.g. "123456789,987654321"
 RAW_ADMIN_IDS: str = os.getenv("ADMIN_IDS", "")
@@ -1,12 +1,44 @@
+import asyncio
 import os
-import traceback
-from typing import Optional, List, Union, Tuple
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, FrozenSet, Iterable, Optional, List, Set, Union, Tuple
+from urllib.request import pathname2url
 
 import aiosqlite
 from loguru import logger
 
 from animachpostingbot.config.config import DB_FILE
 
+# Applied once to every new connection. busy_timeout makes competing
+# connections wait instead of failing with SQLITE_BUSY.
+CONNECTION_PRAGMAS = """
+    PRAGMA busy_timeout = 5000;
+    PRAGMA cache_size = -20000;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA mmap_size = 268435456;
+    PRAGMA foreign_keys = ON;
+"""
+
+# Applied to the writer only. WAL with synchronous=NORMAL turns commits into
+# appends without an fsync per transaction and lets readers run alongside it.
+WRITER_PRAGMAS = """
+    PRAGMA journal_mode = WAL;
+    PRAGMA synchronous = NORMAL;
+"""
+
+# Number of read-only connections used for SELECTs.
+READ_POOL_SIZE = 4
+
+# Size of the sqlite3 prepared-statement cache kept by every connection.
+STATEMENT_CACHE_SIZE = 256
+
+# Rows fetched per hop to the connection thread when streaming a large result.
+ITER_CHUNK_SIZE = 1000
+
+# Maximum number of bound parameters used by a single IN (...) query; stays
+# below SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds (999).
+MAX_IN_PARAMS = 900
+
 
 class Database:
     def __init__(self, db_file: str = DB_FILE):
@@ -16,23 +48,172 @@ class Database:
         os.makedirs(db_dir, exist_ok=True)
         logger.info(f"Database initialized with file: {self.db_file}")
         logger.info(f"Database file path: {os.path.abspath(self.db_file)}")
-        # Log a short traceback to see where this instance was created.
-        stack = "".join(traceback.format_stack(limit=10))
-        logger.debug(f"Created with call stack:\n{stack}")
+        # Long-lived connections are shared by all queries instead of
+        # reconnecting (and re-reading the schema) on every call: one writer
+        # and a pool of read-only connections, matching WAL's
+        # multiple-reader/single-writer model.
+        self._write_conn: Optional[aiosqlite.Connection] = None
+        self._read_conns: Optional[asyncio.Queue] = None
+        self._all_read_conns: List[aiosqlite.Connection] = []
+        self._conn_lock = asyncio.Lock()
+        # Serializes explicit write transactions on the writer connection.
+        self._write_lock = asyncio.Lock()
+        # In-memory copy of all posted GUIDs, loaded by warmup(); every change to the
+        # posted_guids table goes through this class, which keeps it current.
+        self._posted_guids: Optional[Set[str]] = None
+        # In-memory copy of the settings table, loaded by warmup(); all writes
+        # go through set_setting, which keeps it current.
+        self._settings: Optional[Dict[str, str]] = None
+        # Users grouped by source, filled on first listing and dropped by every change
+        # to the users table, so unchanged user lists are not re-read every cycle.
+        self._users_by_source: Optional[Dict[str, List[str]]] = None
+        # The same user IDs as one set per source, for membership checks; rebuilt together
+        # with _users_by_source and only read while that is loaded.
+        self._user_id_sets: Dict[str, FrozenSet[str]] = {}
+        # Bumped by every change to the users table, so a load that overlapped a change
+        # doesn't cache the rows it read before it.
+        self._users_generation = 0
+
+    async def connect(self) -> aiosqlite.Connection:
+        """
+        Returns the writer connection, opening it on first use.
+        """
+        if self._write_conn is not None:
+            return self._write_conn
+        async with self._conn_lock:
+            if self._write_conn is None:
+                # isolation_level=None disables the implicit transactions of the
+                # sqlite3 module; writes open their own with BEGIN IMMEDIATE.
+                conn = await aiosqlite.connect(
+                    self.db_file, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE
+                )
+                await conn.executescript(WRITER_PRAGMAS)
+                await self._configure_connection(conn)
+                self._write_conn = conn
+                logger.info(f"Opened database connection to {self.db_file}")
+        return self._write_conn
+
+    async def _open_read_pool(self) -> asyncio.Queue:
+        """
+        Returns the queue of idle read-only connections, opening them on first use.
+        """
+        if self._read_conns is not None:
+            return self._read_conns
+        # The writer creates the file and switches it to WAL before any reader
+        # opens it in read-only mode.
+        await self.connect()
+        async with self._conn_lock:
+            if self._read_conns is None:
+                uri = f"file:{pathname2url(os.path.abspath(self.db_file))}?mode=ro"
+                pool: asyncio.Queue = asyncio.Queue()
+                for _ in range(READ_POOL_SIZE):
+                    conn = await aiosqlite.connect(
+                        uri, uri=True, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE
+                    )
+                    await self._configure_connection(conn)
+                    self._all_read_conns.append(conn)
+                    pool.put_nowait(conn)
+                self._read_conns = pool
+                logger.info(f"Opened {READ_POOL_SIZE} read-only connections to {self.db_file}")
+        return self._read_conns
+
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Borrows a read-only connection from the pool for the duration of the block.
+        """
+        pool = await self._open_read_pool()
+        conn = await pool.get()
+        try:
+            yield conn
+        finally:
+            pool.put_nowait(conn)
+
+    async def _configure_connection(self, conn: aiosqlite.Connection):
+        """
+        Applies CONNECTION_PRAGMAS to a freshly opened connection.
+        """
+        await conn.executescript(CONNECTION_PRAGMAS)
+
+    async def close(self):
+        """
+        Closes the writer and all read-only connections.
+        """
+        async with self._conn_lock:
+            for conn in self._all_read_conns:
+                await conn.close()
+            self._all_read_conns = []
+            self._read_conns = None
+            if self._write_conn is not None:
+                await self._write_conn.close()
+                self._write_conn = None
+            logger.info("Database connections closed.")
 
-    async def _execute(self, query: str, params: Tuple = (), commit: bool = False):
+    async def _fetchall(self, query: str, params: Tuple = ()) -> List[Tuple]:
+        """
+        Runs a read-only query on a pooled reader and returns all rows.
+        execute_fetchall runs the statement and the fetch in one hop to the connection's
+        thread, without creating a cursor proxy.
+        """
         try:
-            async with aiosqlite.connect(self.db_file) as db:
-                await db.execute("PRAGMA foreign_keys = ON")
-                async with db.execute(query, params) as cursor:
-                    result = await cursor.fetchall()
-                if commit:
-                    await db.commit()
-                return result
+            async with self._reader() as reader:
+                return list(await reader.execute_fetchall(query, params))
         except Exception as e:
             logger.error(f"Database error: {e}\nQuery: {query}\nParams: {params}")
             raise
 
+    async def _fetchone(self, query: str, params: Tuple = ()) -> Optional[Tuple]:
+        """
+        Runs a read-only query on a pooled reader and returns the first row, if any.
+        """
+        try:
+            async with self._reader() as reader:
+                async with reader.execute(query, params) as cursor:
+                    return await cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Database error: {e}\nQuery: {query}\nParams: {params}")
+            raise
+
+    async def _write(self, query: str, params: Tuple = ()):
+        """
+        Runs a single write statement in its own transaction on the writer connection.
+        """
+        try:
+            db = await self.connect()
+            # BEGIN IMMEDIATE takes the write lock up front, so the transaction
+            # never has to be upgraded from a read lock half-way through.
+            async with self._write_lock:
+                await db.execute("BEGIN IMMEDIATE")
+                try:
+                    await db.execute(query, params)
+                    await db.execute("COMMIT")
+                except Exception:
+                    await db.execute("ROLLBACK")
+                    raise
+        except Exception as e:
+            logger.error(f"Database error: {e}\nQuery: {query}\nParams: {params}")
+            raise
+
+    async def _executemany(self, query: str, params_seq: List[Tuple]):
+        """
+        Runs a write statement for every parameter tuple inside a single transaction.
+        """
+        if not params_seq:
+            return
+        try:
+            db = await self.connect()
+            async with self._write_lock:
+                await db.execute("BEGIN IMMEDIATE")
+                try:
+                    await db.executemany(query, params_seq)
+                    await db.execute("COMMIT")
+                except Exception:
+                    await db.execute("ROLLBACK")
+                    raise
+        except Exception as e:
+            logger.error(f"Database error: {e}\nQuery: {query}\nRows: {len(params_seq)}")
+            raise
+
     async def init_db(self):
         """
         Create the users, posted_guids, and settings tables if they don't exist.
@@ -52,16 +233,51 @@ class Database:
                 posted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """
+        # The primary key starts with user_id, so it can't serve lookups by source;
+        # (source, user_id) also covers the listing queries, which read only these columns.
+        create_users_source_index_query = """
+            CREATE INDEX IF NOT EXISTS idx_users_source ON users (source, user_id)
+        """
         create_settings_query = """
             CREATE TABLE IF NOT EXISTS settings (
                 key TEXT PRIMARY KEY,
                 value TEXT
             )
         """
-        await self._execute(create_users_query, commit=True)
-        await self._execute(create_guids_query, commit=True)
-        await self._execute(create_settings_query, commit=True)
-        logger.info("Database initialized with tables 'users', 'posted_guids', and 'settings'.")
+        create_feed_validators_query = """
+            CREATE TABLE IF NOT EXISTS feed_validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT
+            )
+        """
+        await self._write(create_users_query)
+        await self._write(create_users_source_index_query)
+        await self._write(create_guids_query)
+        await self._write(create_settings_query)
+        await self._write(create_feed_validators_query)
+        logger.info(
+            "Database initialized with tables 'users', 'posted_guids', 'settings', and 'feed_validators'."
+        )
+        await self.warmup()
+
+    async def warmup(self):
+        """
+        Primes the page cache with the hot tables and loads the settings table and the
+        posted GUIDs into memory, so the first queries of a cycle don't pay for a cold cache
+        and "already posted" checks need no query at all.
+        """
+        db = await self.connect()
+        async with self._write_lock:
+            await db.execute("PRAGMA optimize")
+        (users_count,) = await self._fetchone("SELECT count(*) FROM users")
+        self._posted_guids = {guid async for guid in self.iter_posted_guids()}
+        settings_rows = await self._fetchall("SELECT key, value FROM settings")
+        self._settings = {key: value for key, value in settings_rows}
+        logger.info(
+            f"Database warmed up: {users_count} users, {len(self._posted_guids)} posted guids "
+            f"and {len(self._settings)} settings cached."
+        )
 
     # ---------------------------
     # CRUD for the "users" table
@@ -70,13 +286,21 @@ class Database:
         """
         Adds a user with the given user_id and source.
         """
-        await self._execute(
+        await self._write(
             "INSERT OR IGNORE INTO users (user_id, source) VALUES (?, ?)",
-            (user_id, source),
-            commit=True
+            (user_id, source)
         )
+        self._invalidate_users()
         logger.info(f"Added user: {user_id} with source: {source}")
 
+    async def add_users(self, users: List[Tuple[str, str]]):
+        """
+        Adds several (user_id, source) pairs in one transaction.
+        """
+        await self._executemany("INSERT OR IGNORE INTO users (user_id, source) VALUES (?, ?)", users)
+        self._invalidate_users()
+        logger.info(f"Added {len(users)} users.")
+
     async def remove_user(self, user_ids: Union[str, List[str]], source: str):
         """
         Removes a user or a list of users from the database for a given source.
@@ -89,74 +313,189 @@ class Database:
         else:
             query = "DELETE FROM users WHERE user_id = ? AND source = ?"
             params = (user_ids, source)
-        await self._execute(query, params, commit=True)
+        await self._write(query, params)
+        self._invalidate_users()
         logger.info(f"Removed user(s): {user_ids} from source: {source}")
 
     async def list_users_by_source(self, source: str) -> List[str]:
         """
         Returns a list of user_ids filtered by the given source.
         """
-        rows = await self._execute("SELECT user_id FROM users WHERE source = ?", (source,))
+        rows = await self._fetchall("SELECT user_id FROM users WHERE source = ?", (source,))
         user_list = [row[0] for row in rows]
-        logger.info(f"Listed users from source '{source}': {user_list}")
+        logger.debug("Listed users from source '{}': {}", source, user_list)
         return user_list
 
+    def _invalidate_users(self) -> None:
+        """
+        Drops the users cache; called after every change to the users table.
+        """
+        self._users_by_source = None
+        self._users_generation += 1
+
+    async def _load_users(self) -> Tuple[Dict[str, List[str]], Dict[str, FrozenSet[str]]]:
+        """
+        Returns all users grouped by source, as lists and as sets, from the users cache.
+        If it isn't loaded, reads them in a single query and caches the result, unless
+        the users table was changed while the query ran.
+        """
+        if self._users_by_source is not None:
+            return self._users_by_source, self._user_id_sets
+        generation = self._users_generation
+        rows = await self._fetchall("SELECT source, user_id FROM users")
+        users_by_source: Dict[str, List[str]] = {}
+        for source, user_id in rows:
+            users_by_source.setdefault(source, []).append(user_id)
+        user_id_sets = {source: frozenset(ids) for source, ids in users_by_source.items()}
+        if generation == self._users_generation:
+            self._users_by_source = users_by_source
+            self._user_id_sets = user_id_sets
+        counts = {source: len(ids) for source, ids in users_by_source.items()}
+        logger.info(f"Listed users from all sources: {counts}")
+        return users_by_source, user_id_sets
+
+    async def list_users_grouped_by_source(self) -> Dict[str, List[str]]:
+        """
+        Returns all user_ids in a single query, grouped by source.
+        The result is cached until the users table is changed through this class.
+        """
+        users_by_source, _ = await self._load_users()
+        # Copies, so callers can't modify the cached lists.
+        return {source: list(ids) for source, ids in users_by_source.items()}
+
+    async def get_user_id_set(self, source: str) -> FrozenSet[str]:
+        """
+        Returns the user_ids of one source as a set, from the same cache as
+        list_users_grouped_by_source.
+        """
+        _, user_id_sets = await self._load_users()
+        return user_id_sets.get(source, frozenset())
+
     async def user_exists(self, user_id: str, source: str) -> bool:
         """
         Checks if a user with the given user_id and source exists.
         """
-        rows = await self._execute("SELECT user_id FROM users WHERE user_id = ? AND source = ?", (user_id, source))
-        exists = len(rows) > 0
-        logger.info(f"User '{user_id}' with source '{source}' exists: {exists}")
+        row = await self._fetchone(
+            "SELECT EXISTS(SELECT 1 FROM users WHERE user_id = ? AND source = ?)",
+            (user_id, source)
+        )
+        exists = bool(row[0])
+        logger.debug("User '{}' with source '{}' exists: {}", user_id, source, exists)
         return exists
 
     # -------------------------------------
     # CRUD for the "posted_guids" table
     # -------------------------------------
-    async def add_posted_guid(self, guid: str):
-        await self._execute("INSERT OR IGNORE INTO posted_guids (guid) VALUES (?)", (guid,), commit=True)
-        logger.info(f"Added posted guid: {guid}")
+    async def add_posted_guid(self, guid: str, tg_message_link: Optional[str] = None):
+        """
+        Marks a GUID as posted, storing its Telegram message link (if given) in the same
+        transaction. An existing link is kept when no new one is given.
+        """
+        await self._write(
+            "INSERT INTO posted_guids (guid, tg_message_link) VALUES (?, ?) "
+            "ON CONFLICT(guid) DO UPDATE SET tg_message_link = COALESCE(excluded.tg_message_link, tg_message_link)",
+            (guid, tg_message_link)
+        )
+        if self._posted_guids is not None:
+            self._posted_guids.add(guid)
+        logger.debug("Added posted guid: {}", guid)
 
     async def is_guid_posted(self, guid: str) -> bool:
-        rows = await self._execute("SELECT guid FROM posted_guids WHERE guid = ?", (guid,))
-        is_posted = len(rows) > 0
-        logger.info(f"GUID '{guid}' is already posted: {is_posted}")
+        if self._posted_guids is not None:
+            is_posted = guid in self._posted_guids
+        else:
+            # Not warmed up yet. guid is the primary key, so EXISTS is a single
+            # index probe that stops at the first match.
+            row = await self._fetchone("SELECT EXISTS(SELECT 1 FROM posted_guids WHERE guid = ?)", (guid,))
+            is_posted = bool(row[0])
+        logger.debug("GUID '{}' is already posted: {}", guid, is_posted)
         return is_posted
 
+    async def filter_posted_guids(self, guids: Iterable[str]) -> Set[str]:
+        """
+        Returns the subset of the given GUIDs that are already posted. Answered from memory
+        once warmed up; before that, with one IN (...) query per MAX_IN_PARAMS GUIDs.
+        """
+        if self._posted_guids is not None:
+            return self._posted_guids.intersection(guids)
+        posted: Set[str] = set()
+        unknown = list(dict.fromkeys(guids))
+        for start in range(0, len(unknown), MAX_IN_PARAMS):
+            chunk = unknown[start:start + MAX_IN_PARAMS]
+            placeholders = ",".join("?" for _ in chunk)
+            rows = await self._fetchall(
+                f"SELECT guid FROM posted_guids WHERE guid IN ({placeholders})", tuple(chunk)
+            )
+            posted.update(guid for (guid,) in rows)
+        logger.debug(f"Checked {len(unknown)} GUIDs against the database; {len(posted)} already posted.")
+        return posted
+
+    async def iter_posted_guids(self) -> AsyncIterator[str]:
+        """
+        Yields all posted GUIDs, fetching ITER_CHUNK_SIZE rows at a time, so callers can
+        build their own collection without an intermediate list of every row.
+        """
+        async with self._reader() as reader:
+            async with reader.execute("SELECT guid FROM posted_guids") as cursor:
+                while rows := await cursor.fetchmany(ITER_CHUNK_SIZE):
+                    for (guid,) in rows:
+                        yield guid
+
     async def list_posted_guids(self) -> List[str]:
-        rows = await self._execute("SELECT guid FROM posted_guids")
-        posted_guids = [row[0] for row in rows]
-        logger.info(f"Listed posted guids: {posted_guids}")
+        posted_guids = [guid async for guid in self.iter_posted_guids()]
+        logger.debug("Listed {} posted guids.", len(posted_guids))
         return posted_guids
 
     async def remove_posted_guid(self, guid: str):
-        await self._execute("DELETE FROM posted_guids WHERE guid = ?", (guid,), commit=True)
-        logger.info(f"Removed posted guid: {guid}")
+        await self._write("DELETE FROM posted_guids WHERE guid = ?", (guid,))
+        if self._posted_guids is not None:
+            self._posted_guids.discard(guid)
+        logger.debug("Removed posted guid: {}", guid)
 
     async def update_posted_guid(self, guid: str):
-        await self._execute("UPDATE posted_guids SET posted_at = CURRENT_TIMESTAMP WHERE guid = ?", (guid,), commit=True)
-        logger.info(f"Updated posted guid: {guid}")
+        await self._write("UPDATE posted_guids SET posted_at = CURRENT_TIMESTAMP WHERE guid = ?", (guid,))
+        logger.debug("Updated posted guid: {}", guid)
 
     async def update_tg_message_link(self, guid: str, tg_message_link: str):
-        await self._execute(
+        await self._write(
             "UPDATE posted_guids SET tg_message_link = ? WHERE guid = ?",
-            (tg_message_link, guid),
-            commit=True
+            (tg_message_link, guid)
         )
-        logger.info(f"Updated Telegram message link for GUID {guid}: {tg_message_link}")
+        logger.debug("Updated Telegram message link for GUID {}: {}", guid, tg_message_link)
 
     # ---------------------------
     # CRUD for the "settings" table
     # ---------------------------
     async def get_setting(self, key: str) -> Optional[str]:
-        rows = await self._execute("SELECT value FROM settings WHERE key = ?", (key,))
-        if rows:
-            return rows[0][0]
+        if self._settings is not None:
+            return self._settings.get(key)
+        row = await self._fetchone("SELECT value FROM settings WHERE key = ?", (key,))
+        if row:
+            return row[0]
         return None
 
     async def set_setting(self, key: str, value: str):
-        await self._execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value), commit=True)
-        logger.info(f"Updated setting '{key}' to '{value}'.")
+        await self._write("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+        if self._settings is not None:
+            self._settings[key] = value
+        logger.debug("Updated setting '{}' to '{}'.", key, value)
+
+    # ---------------------------------------
+    # CRUD for the "feed_validators" table
+    # ---------------------------------------
+    async def list_feed_validators(self) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        """
+        Returns the stored (etag, last_modified) pair for every feed URL.
+        """
+        rows = await self._fetchall("SELECT url, etag, last_modified FROM feed_validators")
+        return {url: (etag, last_modified) for url, etag, last_modified in rows}
+
+    async def set_feed_validators(self, url: str, etag: Optional[str], last_modified: Optional[str]):
+        await self._write(
+            "INSERT OR REPLACE INTO feed_validators (url, etag, last_modified) VALUES (?, ?, ?)",
+            (url, etag, last_modified)
+        )
+        logger.debug(f"Updated validators for feed {url}: etag={etag}, last_modified={last_modified}")
 
 
 # Create a singleton instance.
@@ -1,6 +1,6 @@
 import asyncio
 from datetime import datetime, timezone
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 from loguru import logger
 from animachpostingbot.logging_config import setup_logging
@@ -9,25 +9,27 @@ setup_logging()
 
 from animachpostingbot.config.config import (
     RSSHUB_URL,
-    TELEGRAM_BOT_TOKEN,
     CHECK_INTERVAL_IN_SECONDS,
     NOTIFICATION_CHAT_ID, START_FROM_PARSING_DATE,
+    NUM_WORKERS,
+    QUEUE_MAXSIZE,
 )
 from animachpostingbot.parsers.PixivParser import PixivParser
 from animachpostingbot.parsers.TwitterParser import TwitterParser
 # Import the specific exception from your Parser module
-from animachpostingbot.parsers.Parser import InvalidFeed
+from animachpostingbot.parsers.Parser import InvalidFeed, Parser, close_feed_client, feed_validators
+from animachpostingbot.image.image_resizer import close_image_client
 from animachpostingbot.workers import worker
 from animachpostingbot.database.database import db_instance as db
 from animachpostingbot.bot.admin import register_admin_handlers
+from animachpostingbot.bot.telegram_bot import application
 
 
-async def get_pixiv_urls_from_db(database: type(db)) -> List[str]:
+def get_pixiv_urls(user_ids_pixiv: List[str]) -> List[str]:
     """
-    Retrieve a list of Pixiv user IDs from the database and construct Pixiv feed URLs.
-    If no Pixiv users are found, a default user ID is used.
+    Construct Pixiv feed URLs from a list of Pixiv user IDs.
+    If no Pixiv users are given, a default user ID is used.
     """
-    user_ids_pixiv = await database.list_users_by_source("pixiv")
     if not user_ids_pixiv:
         user_ids_pixiv = ["4729811"] # Default user if none in DB
         logger.warning(
@@ -37,12 +39,11 @@ async def get_pixiv_urls_from_db(database: type(db)) -> List[str]:
     return urls
 
 
-async def get_twitter_urls_from_db(database: type(db)) -> List[str]:
+def get_twitter_urls(user_ids_twitter: List[str]) -> List[str]:
     """
-    Retrieve a list of Twitter user IDs from the database and construct Twitter feed URLs.
-    If no Twitter users are found, returns an empty list.
+    Construct Twitter feed URLs from a list of Twitter user IDs.
+    If no Twitter users are given, returns an empty list.
     """
-    user_ids_twitter = await database.list_users_by_source("twitter")
     if not user_ids_twitter:
         logger.warning("No Twitter users found in the database; skipping Twitter feeds.")
         return []
@@ -53,15 +54,26 @@ async def get_twitter_urls_from_db(database: type(db)) -> List[str]:
     return urls
 
 
-async def process_feeds(database: type(db), queue: asyncio.Queue) -> Optional[str]:
+async def get_feed_urls_from_db(database: type(db)) -> Tuple[List[str], List[str]]:
+    """
+    Retrieve all users from the database in a single query and construct
+    the Pixiv and Twitter feed URLs.
+    """
+    users_by_source = await database.list_users_grouped_by_source()
+    pixiv_urls = get_pixiv_urls(users_by_source.get("pixiv", []))
+    twitter_urls = get_twitter_urls(users_by_source.get("twitter", []))
+    return pixiv_urls, twitter_urls
+
+
+async def process_feeds(database: type(db), queue: asyncio.Queue) -> Tuple[Optional[str], List[Parser]]:
     """
     Creates parsers for each URL (both Pixiv and Twitter), processes their feeds,
     and adds items to the queue.
     Returns the maximum published timestamp (as an ISO string) among all processed entries,
-    or None if no entry was processed.
+    or None if no entry was processed, and the parsers whose feed was processed
+    (their feed state is saved once the queue has been worked off).
     """
-    pixiv_urls = await get_pixiv_urls_from_db(database)
-    twitter_urls = await get_twitter_urls_from_db(database)
+    pixiv_urls, twitter_urls = await get_feed_urls_from_db(database)
 
     pixiv_parsers = [PixivParser(url, queue, database) for url in pixiv_urls]
     twitter_parsers = [TwitterParser(url, queue, database) for url in twitter_urls]
@@ -69,66 +81,53 @@ async def process_feeds(database: type(db), queue: asyncio.Queue) -> Optional[st
     all_parsers = pixiv_parsers + twitter_parsers
     if not all_parsers:
         logger.info("No parsers configured. Skipping feed processing.")
-        return None
-
-    # Initialize list for parsed_data with Nones for proper zip pairing later
-    parsed_data_results = [None] * len(all_parsers)
-    tasks = []
-    # Create tasks and store them with their original index
-    for i, parser_instance in enumerate(all_parsers):
-        # Wrap parser.parse_data() to catch exceptions per-parser
-        async def safe_parse_data(p_instance, index):
-            try:
-                return await p_instance.parse_data()
-            except (InvalidFeed, asyncio.TimeoutError) as e:
-                logger.error(f"Failed to fetch/parse feed for {p_instance.url} after retries: {e}. This feed will be skipped in the current cycle.")
-                return None # Indicate failure for this specific feed
-            except Exception as e:
-                logger.error(f"Unexpected error fetching/parsing feed for {p_instance.url}: {e}", exc_info=True)
-                return None # Indicate failure
-
-        tasks.append(asyncio.create_task(safe_parse_data(parser_instance, i)))
+        return None, []
 
-    # Gather results of parsing tasks
-    results = await asyncio.gather(*tasks, return_exceptions=False) # Exceptions are handled in safe_parse_data
-
-    for i, data in enumerate(results):
-        parsed_data_results[i] = data
-
-
-    max_timestamps = []
-    for parser, feed_data in zip(all_parsers, parsed_data_results):
-        if feed_data is None: # Skip if parse_data failed for this parser
-            logger.warning(f"Skipping process_feed for {parser.url} as fetching/parsing failed or returned no data.")
-            continue
+    # Fetch and process each feed in its own task: a feed is processed as soon as its own
+    # fetch finishes, while the slowest feeds are still being downloaded, and its parsed
+    # data can be freed as soon as it has been processed. Exceptions are handled per-parser.
+    async def fetch_and_process(p_instance) -> Tuple[bool, Optional[str]]:
+        try:
+            feed_data = await p_instance.parse_data()
+        except (InvalidFeed, asyncio.TimeoutError) as e:
+            logger.error(f"Failed to fetch/parse feed for {p_instance.url} after retries: {e}. This feed will be skipped in the current cycle.")
+            return False, None # Indicate failure for this specific feed
+        except Exception as e:
+            logger.error(f"Unexpected error fetching/parsing feed for {p_instance.url}: {e}", exc_info=True)
+            return False, None # Indicate failure
+        if feed_data is None: # Skip if parse_data returned no data
+            logger.warning(f"Skipping process_feed for {p_instance.url} as fetching/parsing returned no data.")
+            return False, None
         try:
-            ts = await parser.process_feed(feed_data, default_start=START_FROM_PARSING_DATE)
-            if ts:
-                max_timestamps.append(ts)
+            return True, await p_instance.process_feed(feed_data, default_start=START_FROM_PARSING_DATE)
         except Exception as e:
-            logger.error(f"Error processing feed data for {parser.url}: {e}", exc_info=True)
+            logger.error(f"Error processing feed data for {p_instance.url}: {e}", exc_info=True)
             # Optionally, decide if this should halt the cycle or just skip this feed's processing part
+            return False, None
 
-    return max(max_timestamps) if max_timestamps else None
+    results = await asyncio.gather(*(fetch_and_process(parser_instance) for parser_instance in all_parsers))
+    processed_parsers = [p for p, (processed, _) in zip(all_parsers, results) if processed]
+    max_timestamps = [ts for _, ts in results if ts]
+    return (max(max_timestamps) if max_timestamps else None), processed_parsers
 
 
-async def initialize_posted_guids(database: type(db)) -> None:
+async def initialize_feed_validators(database: type(db)) -> None:
     """
-    Loads posted GUIDs from the database and updates the in-memory set in the worker module.
+    Loads the stored ETag/Last-Modified validators so that the first cycle
+    after a restart can already use conditional requests.
     """
-    posted_guids = await database.list_posted_guids()
-    worker.processed_guids.update(posted_guids) #
-    logger.info(f"Initialized posted GUIDs: {len(posted_guids)} items loaded.")
+    feed_validators.update(await database.list_feed_validators())
+    logger.info(f"Initialized feed validators: {len(feed_validators)} feeds loaded.")
 
 
 async def init_telegram_bot() -> "Application":
     """
     Initializes the Telegram bot application, registers admin handlers,
     and starts the updater polling.
+    The application is the one the workers send through, so the process runs a single
+    Bot and a single set of HTTP connections to the Telegram API.
     """
-    from telegram.ext import Application # Local import for type hint
-
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    app = application
     register_admin_handlers(app) #
 
     await app.initialize()
@@ -173,9 +172,14 @@ async def processing_cycle(app, db_conn, queue: asyncio.Queue) -> Optional[str]:
     logger.info("Starting a new feed processing cycle.")
     # `process_feeds` now handles its own InvalidFeed exceptions per feed.
     # If it raises an unhandled exception, it would be caught by main_loop's critical error handler.
-    new_last_ts = await process_feeds(db_conn, queue)
+    new_last_ts, processed_parsers = await process_feeds(db_conn, queue)
 
     await queue.join()
+    # Like last_posted_timestamp, the feeds' ETags and digests are only stored now that the
+    # workers are done: stored earlier, a restart would skip the feeds with 304s and lose
+    # the entries that were still queued.
+    for parser_instance in processed_parsers:
+        await parser_instance.save_feed_state()
     logger.info(
         f"Cycle complete. Total messages posted to Telegram: {worker.messages_posted_count}" #
     )
@@ -201,13 +205,15 @@ async def main_loop() -> None:
     worker_tasks = []
 
     try:
-        await db.init_db() #
-        await initialize_posted_guids(db) #
-        queue = asyncio.Queue()
+        await db.init_db() # Also loads the posted GUIDs into memory
+        await initialize_feed_validators(db)
+        # Bounded, so feed processing waits for the workers instead of queueing every
+        # batch of a large backlog (and its image URLs) up front.
+        queue = asyncio.Queue(maxsize=QUEUE_MAXSIZE)
 
         app, polling_task = await init_telegram_bot()
 
-        num_workers = 2  # Consider moving to config
+        num_workers = NUM_WORKERS
         worker_tasks = [
             asyncio.create_task(worker.worker(queue, db, worker_id=i + 1)) #
             for i in range(num_workers)
@@ -258,8 +264,17 @@ async def main_loop() -> None:
                     task.cancel()
             await asyncio.gather(*worker_tasks, return_exceptions=True)
 
+        await close_feed_client()
+        await close_image_client()
+        await db.close()
         logger.info("Shutdown sequence in finally block completed. Bot exiting.")
 
 
 if __name__ == '__main__':
-    asyncio.run(main_loop())
\ No newline at end of file
+    # uvloop's libuv-based event loop is used when it is installed (it is not available on Windows).
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main_loop())
+    else:
+        uvloop.run(main_loop())
\ No newline at end of file
@@ -1,18 +1,88 @@
 import asyncio
+import calendar
+import hashlib
+import html as html_lib
+import importlib.util
+import re
 from datetime import datetime, timezone
-from typing import Any, List, Optional
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import feedparser
-from bs4 import BeautifulSoup
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
 from loguru import logger
 from stamina import retry  # Import the retry decorator from stamina
 
-# Global lock: only one fetch_feed call may run concurrently.
-global_fetch_lock = asyncio.Lock()
+from animachpostingbot.config.config import FEED_FETCH_CONCURRENCY
 
-def chunk_list(lst: List[Any], chunk_size: int) -> List[List[Any]]:
-    return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
+# Per-request timeout for downloading a feed, in seconds.
+FEED_FETCH_TIMEOUT = 10.0
+
+# Global semaphore: at most FEED_FETCH_CONCURRENCY fetch_feed calls may run concurrently.
+global_fetch_semaphore = asyncio.Semaphore(FEED_FETCH_CONCURRENCY)
+
+# Matches the src attribute of <img> tags; used instead of building a full DOM per entry.
+# The attribute must follow whitespace, so data-src and similar attributes don't match;
+# the value runs up to the same quote it opened with, so it may contain the other one.
+IMG_SRC_RE = re.compile(r'<img\b[^>]*?\ssrc\s*=\s*(["\'])(.*?)\1', re.IGNORECASE | re.DOTALL)
+# Counts <img> tags, to tell whether IMG_SRC_RE found the src of every one of them.
+IMG_TAG_RE = re.compile(r'<img\b', re.IGNORECASE)
+
+# Entries with a category containing any of these substrings are not posted
+# (manga, R-18 and AI-generated works); one regex pass instead of a test per substring.
+SKIPPED_CATEGORY_RE = re.compile("漫画|R-18|AI")
+
+# BeautifulSoup backend for the fallback path: the C-based lxml parser when it is
+# installed, otherwise the pure-Python html.parser.
+SOUP_FEATURES = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+# Shared filter that makes the fallback parse build tree nodes for <img> tags only.
+IMG_STRAINER = SoupStrainer("img")
+
+# Shared HTTP client so that all feeds (mostly served by the same RSSHub host)
+# reuse keep-alive connections instead of reconnecting on every fetch.
+_feed_client: Optional[httpx.AsyncClient] = None
+
+# Cache validators (ETag, Last-Modified) of the last successfully processed
+# response for each feed URL, used for conditional GETs. Loaded from and
+# persisted to the database so they survive restarts.
+feed_validators: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+
+# Digest of the last successfully processed response body for each feed URL, so that
+# an unchanged feed is skipped without parsing even if the server never answers 304.
+# Kept in memory only: after a restart the first fetch of each feed is parsed again.
+feed_digests: Dict[str, bytes] = {}
+
+
+def get_feed_client() -> httpx.AsyncClient:
+    """
+    Returns the shared HTTP client used to download feeds, creating it on first use.
+    """
+    global _feed_client
+    if _feed_client is None or _feed_client.is_closed:
+        _feed_client = httpx.AsyncClient(
+            timeout=FEED_FETCH_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_keepalive_connections=FEED_FETCH_CONCURRENCY),
+        )
+    return _feed_client
+
+
+async def close_feed_client() -> None:
+    """
+    Closes the shared feed HTTP client, if it was created.
+    """
+    global _feed_client
+    if _feed_client is not None:
+        await _feed_client.aclose()
+        _feed_client = None
+
+def chunk_list(lst: List[Any], chunk_size: int) -> Iterator[List[Any]]:
+    # A generator, so each batch is only sliced when it is about to be enqueued.
+    for i in range(0, len(lst), chunk_size):
+        yield lst[i:i + chunk_size]
 
 class InvalidFeed(Exception):
     """Raised when a feed is invalid (bozo flag set or non-200 status)."""
@@ -20,10 +90,18 @@ class InvalidFeed(Exception):
 
 class Parser:
     def __init__(self, url: str, queue: asyncio.Queue, database, soup_parser=BeautifulSoup):
+        """
+        `queue` is expected to be bounded (see QUEUE_MAXSIZE): process_feed then waits for
+        the workers whenever it is full, so a large feed never has more than that many
+        batches queued in memory.
+        """
         self.url = url
         self.queue = queue
         self.db = database
         self.soup_parser = soup_parser
+        # Validators of the fetched response; remembered by save_feed_state.
+        self._pending_validators: Optional[Tuple[Optional[str], Optional[str]]] = None
+        self._pending_digest: Optional[bytes] = None
         logger.info(f"{self.__class__.__name__} initialized with URL: {self.url}")
 
     @retry(
@@ -37,31 +115,62 @@ class Parser:
     async def fetch_feed(self) -> feedparser.FeedParserDict:
         """
         Asynchronously fetches and parses the RSS feed.
-        Each attempt is given a 10-second timeout.
-        If the feed is invalid (bozo error or non-200 status), raises InvalidFeed so that
-        Stamina will retry. This method is wrapped with a global lock so that only one feed
-        is fetched at a time across all Parser instances.
-        After a successful fetch, it throttles for 10 seconds before returning the feed.
+        The feed is downloaded with httpx (each attempt is given a 10-second timeout) and
+        the downloaded bytes are parsed by feedparser in a worker thread, so neither step
+        blocks the event loop.
+        If the feed is invalid (HTTP error, bozo error or non-200 status), raises InvalidFeed
+        so that Stamina will retry. A global semaphore bounds how many feeds are fetched
+        at the same time across all Parser instances.
+        The request is conditional (If-None-Match / If-Modified-Since); if the server answers
+        304 Not Modified, an empty feed with status 304 is returned without parsing. The same
+        is returned when the body is byte-for-byte the one processed last time.
         """
         logger.info(f"Fetching data from feed: {self.url}")
-        # Ensure only one fetch occurs at a time.
-        async with global_fetch_lock:
-            # Impose a 10-second timeout on the blocking call.
-            feed = await asyncio.wait_for(
-                asyncio.to_thread(feedparser.parse, self.url),
-                timeout=10
-            )
-            if feed.get("bozo"):
-                err_msg = f"Error fetching/parsing feed {self.url}: {feed.get('bozo_exception')}"
-                logger.error(err_msg)
-                raise InvalidFeed(err_msg)
-            if "status" in feed and feed["status"] != 200:
-                err_msg = f"Unexpected HTTP status {feed['status']} when fetching feed {self.url}"
+        headers = {}
+        etag, last_modified = feed_validators.get(self.url, (None, None))
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        async with global_fetch_semaphore:
+            try:
+                response = await get_feed_client().get(self.url, headers=headers)
+            except httpx.HTTPError as e:
+                err_msg = f"Error fetching feed {self.url}: {e!r}"
                 logger.error(err_msg)
-                raise InvalidFeed(err_msg)
-            logger.debug(f"Fetched feed with {len(feed.entries)} entries from {self.url}.")
+                raise InvalidFeed(err_msg) from e
+        if response.status_code == 304:
+            logger.info(f"Feed not modified since last fetch: {self.url}")
+            return feedparser.FeedParserDict(status=304, feed={}, entries=[])
+        if response.status_code != 200:
+            err_msg = f"Unexpected HTTP status {response.status_code} when fetching feed {self.url}"
+            logger.error(err_msg)
+            raise InvalidFeed(err_msg)
+
+        digest = hashlib.blake2b(response.content, digest_size=16).digest()
+        if feed_digests.get(self.url) == digest:
+            logger.info(f"Feed content unchanged since last fetch: {self.url}")
+            return feedparser.FeedParserDict(status=304, feed={}, entries=[])
 
-            return feed
+        # The description HTML is only scanned for <img> tags and never rendered, so
+        # feedparser's HTML sanitizing and relative-URI resolution (each a full HTML
+        # re-parse per entry, most of the parse time) are turned off.
+        feed = await asyncio.to_thread(
+            feedparser.parse,
+            response.content,
+            response_headers=dict(response.headers),
+            sanitize_html=False,
+            resolve_relative_uris=False,
+        )
+        if feed.get("bozo"):
+            err_msg = f"Error fetching/parsing feed {self.url}: {feed.get('bozo_exception')}"
+            logger.error(err_msg)
+            raise InvalidFeed(err_msg)
+        logger.debug(f"Fetched feed with {len(feed.entries)} entries from {self.url}.")
+
+        self._pending_validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        self._pending_digest = digest
+        return feed
 
     async def parse_data(self) -> feedparser.FeedParserDict:
         """
@@ -74,6 +183,7 @@ class Parser:
         Processes RSS feed entries:
           - Checks publication date (comparing with the last processed timestamp)
           - Filters entries (via the should_skip_entry hook)
+          - Drops entries that are already posted, with one bulk database lookup
           - Extracts image URLs from the description
           - Splits the image URLs into chunks and adds them to the queue
 
@@ -81,14 +191,32 @@ class Parser:
           An ISO-formatted string of the maximum publication date among processed entries,
           or None if no entry was processed.
         """
+        if feed.get("status") == 304:
+            logger.info(f"Skipping unchanged feed: {self.url}")
+            return None
+
         logger.info(f"Processing data from {self.url}")
         last_posted = await self.get_last_posted_timestamp(default_start)
         logger.debug(f"Using last posted timestamp: {last_posted.isoformat()}")
+        # Publication dates are compared as POSIX timestamps, so no datetime
+        # has to be built per entry.
+        last_posted_ts = last_posted.timestamp()
 
         processed_entries = set()  # To avoid processing duplicates within the same cycle.
         feed_info = feed.get("feed", {})
         user_link = feed_info.get("link", "") or self.url
-        max_processed_ts = None
+        max_processed_ts: Optional[float] = None
+
+        # Candidates are collected as parallel lists so that the "already posted"
+        # check can be done for the whole feed at once.
+        guids: List[str] = []
+        links: List[str] = []
+        published_timestamps: List[float] = []
+        descriptions: List[str] = []
+
+        # Per-entry outcomes are logged at DEBUG and summarized once per feed at INFO.
+        skipped_duplicate = skipped_old = skipped_restricted = already_posted = 0
+        enqueued_entries = enqueued_batches = 0
 
         for entry in reversed(feed.get("entries", [])):
             guid = entry.get("guid", "")
@@ -96,10 +224,11 @@ class Parser:
                 logger.debug("Skipping entry with no valid GUID.")
                 continue
 
-            logger.debug(f"Processing entry: normalized GUID='{guid}'")
+            logger.debug("Processing entry: normalized GUID='{}'", guid)
 
             if guid in processed_entries:
-                logger.info(f"Skipping duplicate entry for GUID: {guid}")
+                logger.debug("Skipping duplicate entry for GUID: {}", guid)
+                skipped_duplicate += 1
                 continue
             processed_entries.add(guid)
 
@@ -109,48 +238,92 @@ class Parser:
                 continue
 
             try:
-                if hasattr(entry, "published_parsed") and entry.published_parsed:
-                    published = datetime(*entry.published_parsed[:6], tzinfo=timezone.utc)
+                published_parsed = entry.get("published_parsed")
+                if published_parsed:
+                    # feedparser normalizes published_parsed to UTC.
+                    published_ts = calendar.timegm(published_parsed)
                 else:
-                    published = datetime.strptime(published_str, "%a, %d %b %Y %H:%M:%S %Z")
+                    # RFC 822 dates, including numeric offsets that strptime's %Z can't read.
+                    published = parsedate_to_datetime(published_str)
                     if published.tzinfo is None:
                         published = published.replace(tzinfo=timezone.utc)
-                logger.debug(f"Parsed publication date: {published}")
+                    published_ts = published.timestamp()
+                logger.debug("Parsed publication date: {} ({})", published_str, published_ts)
             except Exception as e:
                 logger.error(f"Error parsing date for entry {entry.get('link', 'no link')}: {e}")
                 continue
 
-            if published < last_posted:
-                logger.info(f"Skipping old entry: {entry.get('link', 'no link')} (published: {published})")
+            if published_ts < last_posted_ts:
+                logger.debug("Skipping old entry: {} (published: {})", entry.get("link", "no link"), published_str)
+                skipped_old += 1
                 continue
 
             if self.should_skip_entry(entry):
-                logger.info(f"Skipping entry (restricted content): {entry.get('link', 'no link')}")
+                logger.debug("Skipping entry (restricted content): {}", entry.get("link", "no link"))
+                skipped_restricted += 1
                 continue
 
-            if guid and self.db and await self.db.is_guid_posted(guid):
-                logger.info(f"Entry already posted (DB check): {entry.get('link', 'no link')}")
+            guids.append(guid)
+            links.append(entry.get("link", "no link"))
+            published_timestamps.append(published_ts)
+            descriptions.append(entry.get("description", ""))
+
+        posted_guids = await self.db.filter_posted_guids(guids) if self.db and guids else set()
+
+        for guid, link, published_ts, description in zip(guids, links, published_timestamps, descriptions):
+            if guid in posted_guids:
+                logger.debug("Entry already posted (DB check): {}", link)
+                already_posted += 1
                 continue
 
-            description = entry.get("description", "")
             image_urls = self.extract_img_links(description)
 
             if not image_urls:
-                logger.warning(f"No images found in entry: {entry.get('link', 'no link')}")
+                logger.warning(f"No images found in entry: {link}")
                 continue
 
-            logger.debug(f"Found {len(image_urls)} images in entry '{guid}'. Enqueuing batches...")
+            logger.debug("Found {} images in entry '{}'. Enqueuing batches...", len(image_urls), guid)
             for batch in chunk_list(image_urls, 10):
-                await self.queue.put((batch, user_link, guid))
-                logger.info(
-                    f"Enqueued batch: GUID='{guid}', batch size={len(batch)}; "
-                    f"queue size: {self.queue.qsize()}"
+                item = (batch, user_link, guid)
+                # Only suspend when the bounded queue is actually full.
+                try:
+                    self.queue.put_nowait(item)
+                except asyncio.QueueFull:
+                    await self.queue.put(item)
+                logger.debug(
+                    "Enqueued batch: GUID='{}', batch size={}; queue size: {}",
+                    guid, len(batch), self.queue.qsize()
                 )
+                enqueued_batches += 1
+            enqueued_entries += 1
+
+            if max_processed_ts is None or published_ts > max_processed_ts:
+                max_processed_ts = published_ts
 
-            if max_processed_ts is None or published > max_processed_ts:
-                max_processed_ts = published
+        logger.info(
+            f"Processed feed {self.url}: enqueued {enqueued_entries} entries in {enqueued_batches} batches "
+            f"(queue size: {self.queue.qsize()}); skipped {skipped_old} old, {already_posted} already posted, "
+            f"{skipped_restricted} restricted, {skipped_duplicate} duplicate."
+        )
 
-        return max_processed_ts.isoformat() if max_processed_ts else None
+        if max_processed_ts is None:
+            return None
+        return datetime.fromtimestamp(max_processed_ts, tz=timezone.utc).isoformat()
+
+    async def save_feed_state(self) -> None:
+        """
+        Remembers the validators and body digest of the processed response, so that the
+        next fetch of an unchanged feed is answered with 304 or skipped.
+        Must only be called once the workers have handled everything process_feed enqueued:
+        if the bot stops before that, the next run has to process the same feed again.
+        """
+        validators = self._pending_validators
+        if validators and any(validators) and feed_validators.get(self.url) != validators:
+            feed_validators[self.url] = validators
+            if self.db:
+                await self.db.set_feed_validators(self.url, *validators)
+        if self._pending_digest is not None:
+            feed_digests[self.url] = self._pending_digest
 
     async def get_last_posted_timestamp(self, default: datetime) -> datetime:
         last_posted_ts = await self.db.get_setting("last_posted_timestamp")
@@ -168,17 +341,18 @@ class Parser:
         return default
 
     def extract_img_links(self, html: str) -> List[str]:
-        soup = self.soup_parser(html, 'html.parser')
-        links = [img.get('src') for img in soup.find_all('img') if img.get('src')]
+        links = [html_lib.unescape(m.group(2)) for m in IMG_SRC_RE.finditer(html) if m.group(2)]
+        if len(links) < len(IMG_TAG_RE.findall(html)):
+            # Some <img> tags have unusual markup (e.g. unquoted attributes): fall back
+            # to a full HTML parse, so none of their images is dropped.
+            soup = self.soup_parser(html, SOUP_FEATURES, parse_only=IMG_STRAINER)
+            links = [img.get('src') for img in soup.find_all('img') if img.get('src')]
         logger.debug(f"Extracted {len(links)} image links from HTML.")
         return links
 
     def should_skip_entry(self, entry: feedparser.FeedParserDict) -> bool:
         category = entry.get("category", "")
         if isinstance(category, list):
-            if any(("漫画" in cat) or ("R-18" in cat) or ("AI" in cat) for cat in category):
-                return True
-        else:
-            if ("漫画" in category) or ("R-18" in category) or ("AI" in category):
-                return True
-        return False
+            # None of the substrings contains a newline, so joining can't create false matches.
+            category = "\n".join(category)
+        return SKIPPED_CATEGORY_RE.search(category) is not None
@@ -0,0 +1,69 @@
+import functools
+import re
+from typing import Dict, Optional, Tuple, TypeVar
+from urllib.parse import urlparse
+
+T = TypeVar("T")
+
+# Matches the user ID at the start of Pixiv profile paths like /users/<id> or /en/users/<id>;
+# used with match(), so non-profile paths are rejected at the first characters.
+PIXIV_USER_PATH_RE = re.compile(r"/(?:\w+/)?users/(\d+)")
+
+# Source of each known domain; subdomains (www., mobile., ...) belong to the same source.
+SOURCE_BY_DOMAIN = {
+    "pixiv.net": "pixiv",
+    "twitter.com": "twitter",
+    "x.com": "twitter",
+}
+
+# Size of the parse_source_and_user cache, shared by the admin commands and the album
+# captions; roomy enough for every followed artist's profile URL.
+USER_URL_CACHE_SIZE = 4096
+
+
+def lookup_domain(host: str, table: Dict[str, T]) -> Optional[T]:
+    """
+    Returns the entry of `table` for the host, or for its nearest parent domain,
+    with one dict lookup per label instead of a suffix scan per known domain.
+    The host is expected in lowercase, as urlparse(...).hostname returns it.
+    """
+    labels = host.split(".")
+    for i in range(len(labels) - 1):
+        value = table.get(".".join(labels[i:]))
+        if value is not None:
+            return value
+    return None
+
+
+def source_from_host(host: str) -> Optional[str]:
+    """
+    Returns the source ("pixiv" or "twitter") the host belongs to, or None.
+    """
+    return lookup_domain(host, SOURCE_BY_DOMAIN)
+
+
+@functools.lru_cache(maxsize=USER_URL_CACHE_SIZE)
+def parse_source_and_user(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns (source, user_id) for a Pixiv or Twitter profile URL, or (None, None).
+    Memoized, since the same artist URLs come back on every album and every poll; it
+    doesn't log, so callers log the outcome on every call, cached or not.
+    """
+    parsed = urlparse(url)
+    # hostname is already lowercased and stripped of any port.
+    source = source_from_host(parsed.hostname or "")
+
+    # For Pixiv: look for URLs like /users/<id> or /en/users/<id>
+    if source == "pixiv":
+        m = PIXIV_USER_PATH_RE.match(parsed.path)
+        if m:
+            return "pixiv", m.group(1)
+
+    # For Twitter (or x.com)
+    elif source == "twitter":
+        # Assume the URL is of the form /<username>
+        username = parsed.path.lstrip("/").split("/", 1)[0]
+        if username:
+            return "twitter", username
+
+    return None, None
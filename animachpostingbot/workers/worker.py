@@ -1,17 +1,26 @@
 import asyncio
+from collections import OrderedDict
+from typing import Any
 from loguru import logger
 from animachpostingbot.bot.telegram_bot import send_images_to_telegram, application
 from animachpostingbot.config.config import TELEGRAM_CHANNEL_ID
 from animachpostingbot.database.database import db_instance  # for type hints
 
-# Global lock to protect duplicate checking.
-duplicate_lock = asyncio.Lock()
+# How many recent GUIDs the workers remember below; the oldest are dropped beyond that,
+# so memory doesn't grow for as long as the process runs. A dropped GUID that was posted
+# is still answered by the database's in-memory set; one that failed may be retried.
+WORKER_GUID_CACHE_SIZE = 10000
 
-# In-memory set to track normalized GUIDs processed during the current cycle.
-processed_guids = set()
+# Normalized GUIDs recently handled by the workers, including ones that failed, in the
+# order they were handled (used as an ordered set). GUIDs posted before startup are
+# answered by the database; they only end up here if a feed offers them again.
+processed_guids: "OrderedDict[str, None]" = OrderedDict()
 
-# Global dictionary to record the media_group_id for each GUID.
-sent_media_groups = {}  # {normalized_guid: media_group_id}
+# Media_group_id of each recently posted GUID.
+sent_media_groups: "OrderedDict[str, Any]" = OrderedDict()  # {normalized_guid: media_group_id}
+
+# Link prefix of posts in the channel: t.me/c/ links use the channel ID without its "-100" prefix.
+MESSAGE_LINK_PREFIX = f"https://t.me/c/{str(TELEGRAM_CHANNEL_ID)[4:]}/"
 
 # Global counter for messages posted
 messages_posted_count = 0
@@ -23,13 +32,20 @@ async def check_duplicate_and_mark(db, guid: str, worker_id: int) -> bool:
     If not, marks it as processed.
 
     Returns True if it is a duplicate; False otherwise.
+    The GUID is checked and marked with no await in between, so no other worker can
+    claim it meanwhile and no lock is needed; the database is only consulted afterwards.
     """
-    async with duplicate_lock:
-        if guid in processed_guids or await db.is_guid_posted(guid):
-            logger.info(f"[Worker {worker_id}] Skipping duplicate normalized_guid '{guid}'.")
-            return True
-        processed_guids.add(guid)
-        return False
+    if guid in processed_guids:
+        logger.info(f"[Worker {worker_id}] Skipping duplicate normalized_guid '{guid}'.")
+        return True
+    processed_guids[guid] = None
+    if len(processed_guids) > WORKER_GUID_CACHE_SIZE:
+        processed_guids.popitem(last=False)
+
+    if await db.is_guid_posted(guid):
+        logger.info(f"[Worker {worker_id}] Skipping duplicate normalized_guid '{guid}'.")
+        return True
+    return False
 
 
 async def process_successful_post(worker_id: int, guid: str, messages, db) -> None:
@@ -38,9 +54,8 @@ async def process_successful_post(worker_id: int, guid: str, messages, db) -> No
     updating the database, and handling potential duplicate media groups.
     """
     # Extract Telegram message link from the first message in the returned list
-    short_id = str(TELEGRAM_CHANNEL_ID)[4:]
     first_msg = messages[0]
-    tg_message_link = f"https://t.me/c/{short_id}/{first_msg.message_id}"
+    tg_message_link = f"{MESSAGE_LINK_PREFIX}{first_msg.message_id}"
     logger.info(
         f"[Worker {worker_id}] Posting succeeded for normalized_guid '{guid}', "
         f"adding to database with link {tg_message_link}."
@@ -70,8 +85,9 @@ async def process_successful_post(worker_id: int, guid: str, messages, db) -> No
     else:
         # Save the media group id for future comparisons
         sent_media_groups[guid] = media_group_id
-        await db.add_posted_guid(guid)
-        await db.update_tg_message_link(guid, tg_message_link)
+        if len(sent_media_groups) > WORKER_GUID_CACHE_SIZE:
+            sent_media_groups.popitem(last=False)
+        await db.add_posted_guid(guid, tg_message_link)
 
     global messages_posted_count
     messages_posted_count += 1